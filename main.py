@@ -2,31 +2,69 @@ from fastapi import FastAPI, WebSocket, WebSocketDisconnect
 import json
 import random
 import asyncio
-from typing import Dict, List, Set, Optional
+from typing import Dict, List, Set, Optional, Tuple
 from collections import defaultdict
 
 app = FastAPI()
 
+# Max payloads buffered per user before the client is treated as disconnected
+OUT_QUEUE_SIZE = 256
+
+# Max queued payloads merged into a single websocket frame
+WRITE_BATCH_SIZE = 16
+
+# Seconds between drawn words, and between rounds
+WORD_INTERVAL = 2.0
+
+
+try:
+    import orjson
+
+    # C serializer that returns UTF-8 bytes directly
+    _encode = orjson.dumps
+except ImportError:
+
+    def _encode(message: dict) -> bytes:
+        """Serialize a message to UTF-8 JSON bytes, ready to be sent as-is."""
+        return json.dumps(message).encode()
+
 
 class BingoCard:
+    __slots__ = ("id", "words", "language", "marked_words", "_word_set", "_size")
+
     def __init__(self, card_id: str, words: List[str], language: str):
         self.id = card_id
-        self.words = words
+        self.words = list(words)  # keeps card order
         self.language = language
         self.marked_words: Set[str] = set()
+        self._word_set = frozenset(words)  # O(1) membership checks
+        self._size = len(self._word_set)
 
-    def mark_word(self, word: str):
-        if word in self.words:
-            self.marked_words.add(word)
+    def mark_word(self, word: str) -> bool:
+        """Mark word on the card. Returns True iff this mark just completed the card."""
+        if word not in self._word_set or word in self.marked_words:
+            return False
+        self.marked_words.add(word)
+        return len(self.marked_words) == self._size
 
     def is_complete(self) -> bool:
-        return len(self.marked_words) == len(self.words)
+        return len(self.marked_words) == self._size
 
     def get_marked_count(self) -> int:
         return len(self.marked_words)
 
 
 class User:
+    __slots__ = (
+        "id",
+        "name",
+        "websocket",
+        "cards",
+        "word_to_cards",
+        "out_queue",
+        "writer_task",
+    )
+
     def __init__(self, user_id: str, name: str, websocket: WebSocket):
         self.id = user_id
         self.name = name
@@ -35,6 +73,9 @@ class User:
         self.word_to_cards: Dict[str, List[str]] = defaultdict(
             list
         )  # word -> [card_ids]
+        # Outbound payloads, drained by a dedicated writer task
+        self.out_queue: asyncio.Queue = asyncio.Queue(maxsize=OUT_QUEUE_SIZE)
+        self.writer_task: Optional[asyncio.Task] = None
 
     def add_card(self, card: BingoCard):
         self.cards[card.id] = card
@@ -42,42 +83,27 @@ class User:
         for word in card.words:
             self.word_to_cards[word].append(card.id)
 
-    def mark_word(self, word: str, language: str) -> List[str]:
-        """Mark word on all relevant cards. Returns list of card IDs that were marked."""
+    def mark_word(self, word: str, language: str) -> Tuple[List[str], List[str]]:
+        """Mark word on all relevant cards.
+
+        Returns (marked_card_ids, completed_card_ids), where the latter holds the
+        cards that this word just completed.
+        """
         marked_card_ids = []
+        completed_card_ids = []
         if word in self.word_to_cards:
             for card_id in self.word_to_cards[word]:
                 card = self.cards.get(card_id)
                 if card and card.language == language:
-                    card.mark_word(word)
+                    if card.mark_word(word):
+                        completed_card_ids.append(card_id)
                     marked_card_ids.append(card_id)
-        return marked_card_ids
-
-    def get_card_with_most_marks(self, language: str) -> Optional[BingoCard]:
-        """Get the card with the most marked words for a given language."""
-        best_card = None
-        max_marks = -1
-        for card in self.cards.values():
-            if card.language == language:
-                marked_count = card.get_marked_count()
-                if marked_count > max_marks:
-                    max_marks = marked_count
-                    best_card = card
-        return best_card
-
-    def has_completed_card(self, language: str) -> bool:
-        """Check if user has a completed card for a given language."""
-        for card in self.cards.values():
-            if card.language == language and card.is_complete():
-                return True
-        return False
+        return marked_card_ids, completed_card_ids
 
-    def remove_words_from_sets(self, language_to_words: Dict[str, Set[str]]):
-        """Remove user's words from the language word sets when disconnecting."""
+    def clear_marks(self):
+        """Clear marked words on all cards, e.g. when the game resets."""
         for card in self.cards.values():
-            for word in card.words:
-                if word in language_to_words.get(card.language, set()):
-                    language_to_words[card.language].discard(word)
+            card.marked_words.clear()
 
 
 class GameManager:
@@ -89,28 +115,95 @@ class GameManager:
             "portuguese": set(),
             "dutch": set(),
         }
+        # (language, word) -> user_ids holding that word on a card
+        self.word_to_users: Dict[Tuple[str, str], Set[str]] = defaultdict(set)
         self.game_started = False
         self.current_round = None
         self.round_languages = []
         self.current_language_index = 0
-        self.winners: List[str] = []
+        self.unique_winners: Dict[str, None] = {}  # insertion-ordered set
+        self.word_interval = WORD_INTERVAL
+        self._player_count_payload: Optional[Tuple[int, bytes]] = None
+        self._game_task: Optional[asyncio.Task] = None
+        self._background: Set[asyncio.Task] = set()
 
     async def add_user(self, user_id: str, name: str, websocket: WebSocket):
         user = User(user_id, name, websocket)
+        user.writer_task = asyncio.create_task(self._writer(user))
         self.users[user_id] = user
         await self.broadcast_player_count()
 
+    async def _writer(self, user: User):
+        """Drain the user's outbound queue onto the websocket.
+
+        Payloads already waiting in the queue are merged into one JSON array
+        frame, so bursts cost a single send.
+        """
+        queue = user.out_queue
+        try:
+            while True:
+                batch = [await queue.get()]
+                while not queue.empty() and len(batch) < WRITE_BATCH_SIZE:
+                    batch.append(queue.get_nowait())
+                await user.websocket.send_bytes(b"[" + b",".join(batch) + b"]")
+        except (WebSocketDisconnect, RuntimeError, OSError):
+            # _discard_user skips cancelling the writer it is called from
+            await self.remove_user(user.id)
+
     async def remove_user(self, user_id: str):
-        if user_id in self.users:
-            user = self.users[user_id]
-            # Remove user's words from language sets
-            user.remove_words_from_sets(self.language_word_sets)
-            del self.users[user_id]
-            await self.broadcast_player_count()
-
-            # If no users left, reset game
-            if len(self.users) == 0:
-                self.reset_game()
+        await self.remove_users([user_id])
+
+    async def remove_users(self, user_ids: List[str], close: bool = False):
+        """Remove several users, then announce the new player count once.
+
+        With close=True the users' sockets are closed too, for clients that are
+        still connected but can't keep up.
+        """
+        removed = [
+            user_id for user_id in user_ids if self._discard_user(user_id, close)
+        ]
+        if not removed:
+            return
+        await self.broadcast_player_count()
+
+        # If no users left, reset game
+        if len(self.users) == 0:
+            self.reset_game()
+
+    def _discard_user(self, user_id: str, close: bool = False) -> bool:
+        """Drop a user's state. Returns False if the user was already gone."""
+        user = self.users.pop(user_id, None)
+        if user is None:
+            return False
+        if user.writer_task and user.writer_task is not asyncio.current_task():
+            user.writer_task.cancel()
+            if close:
+                # Let the client's onclose reload rejoin the player
+                self._spawn(self._close_socket(user.websocket))
+        # Drop user from the word index; evict words nobody else holds
+        for card in user.cards.values():
+            for word in card.words:
+                key = (card.language, word)
+                holders = self.word_to_users.get(key)
+                if holders is None:
+                    continue
+                holders.discard(user_id)
+                if not holders:
+                    self.language_word_sets[card.language].discard(word)
+                    del self.word_to_users[key]
+        return True
+
+    async def _close_socket(self, websocket: WebSocket):
+        try:
+            await websocket.close(code=1008)
+        except (RuntimeError, OSError):
+            pass  # Already closed
+
+    def _spawn(self, coro):
+        """Run a background task, keeping a reference until it finishes."""
+        task = asyncio.create_task(coro)
+        self._background.add(task)
+        task.add_done_callback(self._background.discard)
 
     async def add_card(self, user_id: str, card_data: dict):
         if user_id not in self.users:
@@ -124,6 +217,7 @@ class GameManager:
         language = card.language
         for word in card.words:
             self.language_word_sets[language].add(word)
+            self.word_to_users[(language, word)].add(user_id)
 
     async def start_game(self):
         if self.game_started:
@@ -138,15 +232,29 @@ class GameManager:
         # Notify all users
         await self.broadcast({"type": "game_started"})
 
-        # Start first round
-        await self.start_round()
-
-    async def start_round(self):
-        if self.current_language_index >= len(self.round_languages):
+        # Run the game on its own task so it isn't tied to the caller's websocket
+        self._game_task = asyncio.create_task(self._run_game())
+
+    async def _run_game(self):
+        """Play every round in order, then end the game."""
+        try:
+            for index, language in enumerate(self.round_languages):
+                self.current_language_index = index
+                await self._run_round(language)
+                if self._was_reset():
+                    return
             await self.end_game()
-            return
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            print(f"Game error: {e}")
+        finally:
+            # end_game and reset_game clear _game_task; if it is still this
+            # task, the game stopped some other way and must be reset
+            if self._game_task is asyncio.current_task():
+                self.reset_game()
 
-        language = self.round_languages[self.current_language_index]
+    async def _run_round(self, language: str):
         self.current_round = language
 
         # Notify all users
@@ -158,114 +266,142 @@ class GameManager:
                 "total_rounds": len(self.round_languages),
             }
         )
+        if self._was_reset():
+            return
 
-        # Start word selection loop
-        await self.round_loop()
-
-    async def round_loop(self):
-        language = self.current_round
         word_set = self.language_word_sets.get(language, set())
 
-        # Convert to list for random selection
+        # Shuffle once so each draw is an O(1) pop from the end
         available_words = list(word_set)
+        random.shuffle(available_words)
 
+        winners_this_round: List[str] = []
         while available_words:
-            # Select random word
-            word = random.choice(available_words)
-            available_words.remove(word)
-
-            # Mark word on all users' cards and send personalized messages
-            for user_id, user in self.users.items():
-                marked_card_ids = user.mark_word(word, language)
-                # Send personalized message to this user
-                await self.send_to_user(
-                    user_id,
-                    {
-                        "type": "word_selected",
-                        "word": word,
-                        "language": language,
-                        "card_ids": marked_card_ids,
-                    },
-                )
+            word = available_words.pop()
+            winners_this_round = await self._play_word(language, word)
+            if self._was_reset():
+                return
+            if winners_this_round:
+                break
+            # Wait before next word
+            await self._pause()
 
-            # Check if any user completed a card
-            winners_this_round = []
-            for user_id, user in self.users.items():
-                if user.has_completed_card(language):
-                    winners_this_round.append(user.name)
+        self.unique_winners.update(dict.fromkeys(winners_this_round))
+        await self.broadcast(
+            {"type": "round_end", "language": language, "winners": winners_this_round}
+        )
+        # Wait a bit before next round
+        await self._pause()
 
-            if winners_this_round:
-                self.winners.extend(winners_this_round)
-                await self.broadcast(
-                    {
-                        "type": "round_end",
-                        "language": language,
-                        "winners": winners_this_round,
-                    }
-                )
-                # Wait a bit before next round
-                await asyncio.sleep(2)
-                self.current_language_index += 1
-                await self.start_round()
-                return
+    def _was_reset(self) -> bool:
+        """Check if reset_game ran inside the game task, e.g. the last user left."""
+        return self._game_task is not asyncio.current_task()
 
-            # Wait before next word
-            await asyncio.sleep(2)
+    async def _pause(self):
+        """Pace the game, skipping the wait when nobody is connected to watch."""
+        if self.users:
+            await asyncio.sleep(self.word_interval)
 
-        # No more words, move to next round
-        await self.broadcast({"type": "round_end", "language": language, "winners": []})
-        await asyncio.sleep(2)
-        self.current_language_index += 1
-        await self.start_round()
+    async def _play_word(self, language: str, word: str) -> List[str]:
+        """Draw a word: announce it, mark cards, and return this word's winners."""
+        # Announce the word to everyone with a single shared payload
+        await self.broadcast(
+            {"type": "word_selected", "word": word, "language": language}
+        )
 
-    async def end_game(self):
-        # Count winners by name
-        winner_counts = defaultdict(int)
-        for winner in self.winners:
-            winner_counts[winner] += 1
+        # Mark word on all users' cards and tell each user which cards matched
+        results = []
+        completed_user_ids = []
+        for user_id in self.word_to_users.get((language, word), ()):
+            user = self.users.get(user_id)
+            if user is None:
+                continue
+            marked_card_ids, completed_card_ids = user.mark_word(word, language)
+            if completed_card_ids:
+                completed_user_ids.append(user_id)
+            if marked_card_ids:
+                results.append(
+                    self._safe_send(
+                        user_id,
+                        _encode(
+                            {
+                                "type": "cards_marked",
+                                "word": word,
+                                "language": language,
+                                "card_ids": marked_card_ids,
+                            }
+                        ),
+                    )
+                )
+        await self._remove_failed(results)
 
-        # Get unique winners
-        unique_winners = list(winner_counts.keys())
+        # Winners are the still-connected users this word completed a card for
+        return [
+            self.users[user_id].name
+            for user_id in completed_user_ids
+            if user_id in self.users
+        ]
 
-        await self.broadcast({"type": "game_end", "winners": unique_winners})
+    async def end_game(self):
+        await self.broadcast({"type": "game_end", "winners": list(self.unique_winners)})
 
         # Reset game state
         self.reset_game()
 
     def reset_game(self):
+        game_task, self._game_task = self._game_task, None
+        if game_task and game_task is not asyncio.current_task():
+            game_task.cancel()
         self.game_started = False
         self.current_round = None
         self.round_languages = []
         self.current_language_index = 0
-        self.winners = []
+        self.unique_winners = {}
         # Clear all marked words from cards
         for user in self.users.values():
-            for card in user.cards.values():
-                card.marked_words.clear()
+            user.clear_marks()
 
     async def broadcast(self, message: dict):
-        message_str = json.dumps(message)
+        await self._fanout(_encode(message))
+
+    async def _fanout(self, payload: bytes):
+        """Queue the same payload for every user, then drop those whose queue is full."""
         disconnected = []
-        for user_id, user in self.users.items():
+        for user in list(self.users.values()):
             try:
-                await user.websocket.send_text(message_str)
-            except:
-                disconnected.append(user_id)
-
-        # Remove disconnected users
-        for user_id in disconnected:
-            await self.remove_user(user_id)
+                user.out_queue.put_nowait(payload)
+            except asyncio.QueueFull:
+                disconnected.append(user.id)
+        if disconnected:
+            await self.remove_users(disconnected, close=True)
 
     async def broadcast_player_count(self):
-        await self.broadcast({"type": "player_count", "count": len(self.users)})
-
-    async def send_to_user(self, user_id: str, message: dict):
-        if user_id in self.users:
-            try:
-                message_str = json.dumps(message)
-                await self.users[user_id].websocket.send_text(message_str)
-            except:
-                await self.remove_user(user_id)
+        # Reuse the encoded payload while the count is unchanged
+        count = len(self.users)
+        if self._player_count_payload is None or self._player_count_payload[0] != count:
+            self._player_count_payload = (
+                count,
+                _encode({"type": "player_count", "count": count}),
+            )
+        await self._fanout(self._player_count_payload[1])
+
+    def _safe_send(self, user_id: str, payload: bytes) -> Tuple[str, bool]:
+        """Queue a payload without removing the user on failure. Returns (user_id, ok)."""
+        user = self.users.get(user_id)
+        if user is None:
+            return user_id, True
+        try:
+            user.out_queue.put_nowait(payload)
+            return user_id, True
+        except asyncio.QueueFull:
+            # Client can't keep up; treat it as disconnected
+            return user_id, False
+
+    async def _remove_failed(self, results: List[Tuple[str, bool]]):
+        """Remove every user whose send failed."""
+        disconnected = [user_id for user_id, ok in results if not ok]
+        if disconnected:
+            await self.remove_users(disconnected, close=True)
 
 
 game_manager = GameManager()
@@ -298,3 +434,13 @@ async def websocket_endpoint(websocket: WebSocket, client_id: str):
     except Exception as e:
         print(f"Error: {e}")
         await game_manager.remove_user(client_id)
+
+
+if __name__ == "__main__":
+    import uvicorn
+
+    # Payloads are encoded once per broadcast; per-message deflate would
+    # recompress them separately for every connection. Run the server with
+    # `python main.py`, or pass `--ws-per-message-deflate false` when
+    # launching through `uvicorn main:app` / `fastapi run main.py`.
+    uvicorn.run(app, host="0.0.0.0", port=8000, ws_per_message_deflate=False)
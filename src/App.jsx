@@ -27,6 +27,9 @@ function getWebSocketUrl(userId) {
 
 const userUUID = crypto.randomUUID();
 
+// Server messages arrive as UTF-8 encoded binary frames
+const textDecoder = new TextDecoder();
+
 // Language configurations
 const LANGUAGE_CONFIGS = {
   spanish: { rows: 4, cols: 6, total: 24 },
@@ -77,6 +80,7 @@ function App() {
 
     const wsUrl = getWebSocketUrl(userUUID);
     const socket = new WebSocket(wsUrl);
+    socket.binaryType = 'arraybuffer';
     socketRef.current = socket;
 
     socket.onopen = () => {
@@ -97,8 +101,13 @@ function App() {
 
     socket.onmessage = (event) => {
       try {
-        const data = JSON.parse(event.data);
-        handleWebSocketMessage(data);
+        const text = typeof event.data === 'string'
+          ? event.data
+          : textDecoder.decode(event.data);
+        // The server batches messages into a JSON array per frame
+        const data = JSON.parse(text);
+        const messages = Array.isArray(data) ? data : [data];
+        messages.forEach(handleWebSocketMessage);
       } catch (e) {
         console.error('Error parsing websocket message:', e);
       }
@@ -118,6 +127,8 @@ function App() {
         break;
       case 'word_selected':
         setCurrentWord(data.word);
+        break;
+      case 'cards_marked':
         // Mark word on cards (data.card_ids contains list of card IDs that should be marked)
         setBingoCards(prevCards => {
           const updated = prevCards.map(card => {